@@ -0,0 +1,10 @@
+"""
+Django settings for running the test suite, on top of the app settings.
+"""
+from app.settings import *  # noqa: F401,F403
+
+# The default PBKDF2 hasher is deliberately slow and the tests create users
+# all the time, so use a cheap hasher instead.
+PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.MD5PasswordHasher",
+]
@@ -40,8 +40,24 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+class RecipeAdmin(admin.ModelAdmin):
+    """define admin pages for recipes"""
+    list_display = ["id", "title", "user"]
+    #joins the user into the changelist query instead of one query per row
+    list_select_related = ["user"]
+    list_per_page = 50
+    search_fields = ["title"]
+    list_filter = ["tags"]
+
+class RecipeAttrAdmin(admin.ModelAdmin):
+    """define admin pages for tags and ingredients"""
+    list_display = ["id", "name", "user"]
+    list_select_related = ["user"]
+    list_per_page = 50
+    search_fields = ["name"]
+
 #useradmin is added here as a custom model
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
\ No newline at end of file
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.Tag, RecipeAttrAdmin)
+admin.site.register(models.Ingredient, RecipeAttrAdmin)
@@ -1,14 +1,18 @@
 """"wait for db to be available"""
 
-from operator import truediv
 import time
 
 from psycopg2 import OperationalError as Psycopg20pError
 
+from django.db import connections
 from django.db.utils import OperationalError
 
 from django.core.management.base import BaseCommand
 
+#seconds to wait after the first failed attempt, doubled on every retry up to the max
+INITIAL_DELAY = 0.5
+MAX_DELAY = 5
+
 class Command(BaseCommand):
     """django command to wait for db"""
 
@@ -16,12 +20,14 @@ class Command(BaseCommand):
         """entry  point for command"""
         self.stdout.write("waiting for db...")
         db_up = False
+        delay = INITIAL_DELAY
         while db_up is False:
             try:
-                self.check(databases= ["default"])
+                #opening a connection is enough, no need to run the whole system check framework
+                connections["default"].ensure_connection()
                 db_up=True
             except (Psycopg20pError, OperationalError):
-                self.stdout.write("db unavailable, waiting 1s")
-                time.sleep(1)
+                self.stdout.write(f"db unavailable, waiting {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_DELAY)
         self.stdout.write(self.style.SUCCESS("db available!"))
-
@@ -0,0 +1,57 @@
+# Merges tags/ingredients a user holds twice under the same name, so the
+# unique (user, name) constraints in the next migration can be added.
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, model_name, recipe_field):
+    """keep the oldest row of each (user, name) and move the others' recipe links to it"""
+    model = apps.get_model("core", model_name)
+    Recipe = apps.get_model("core", "Recipe")
+    field = Recipe._meta.get_field(recipe_field)
+    through = field.remote_field.through
+    item_column = field.m2m_reverse_name()
+
+    duplicates = model.objects.values("user", "name").annotate(
+        keep_id=Min("id"), count=Count("id"),
+    ).filter(count__gt=1)
+
+    for duplicate in duplicates:
+        keep_id = duplicate["keep_id"]
+        others = model.objects.filter(
+            user=duplicate["user"],
+            name=duplicate["name"],
+        ).exclude(id=keep_id)
+
+        linked = set(through.objects.filter(
+            **{item_column: keep_id}
+        ).values_list("recipe_id", flat=True))
+        for link in through.objects.filter(**{f"{item_column}__in": others}):
+            if link.recipe_id in linked:
+                link.delete()
+            else:
+                setattr(link, item_column, keep_id)
+                link.save()
+                linked.add(link.recipe_id)
+
+        others.delete()
+
+
+def merge_duplicate_tags_ingredients(apps, schema_editor):
+    merge_duplicates(apps, "Tag", "tags")
+    merge_duplicates(apps, "Ingredient", "ingredients")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_auto_20230725_0859'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_tags_ingredients,
+            migrations.RunPython.noop,
+        ),
+    ]
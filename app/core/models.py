@@ -73,6 +73,13 @@ class Tag(models.Model):
         on_delete = models.CASCADE,
     )
 
+    class Meta:
+        #the (user, name) index behind this constraint also serves the tag/ingredient
+        #list's filter(user=...).order_by("-name") as a backward index scan, no sort needed
+        constraints = [
+            models.UniqueConstraint(fields=["user", "name"], name="unique_tag_name_per_user"),
+        ]
+
     def __str__ (self):
         return self.name
 
@@ -83,6 +90,11 @@ class Ingredient(models.Model):
         on_delete = models.CASCADE,
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "name"], name="unique_ingredient_name_per_user"),
+        ]
+
     def __str__ (self):
         return self.name
 
@@ -1,10 +1,14 @@
 """test for admin"""
 
+from decimal import Decimal
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import Client
 
+from core.models import Recipe
+
 class AdminSiteTests(TestCase):
 
     def setUp(self):
@@ -41,3 +45,16 @@ class AdminSiteTests(TestCase):
         
         self.assertEqual(res.status_code, 200)
 
+    def test_recipes_list(self):
+        """test that recipes are listed with their user"""
+        recipe = Recipe.objects.create(
+            user = self.user,
+            title = "sample recipe",
+            time_minutes = 5,
+            price = Decimal("5.50"),
+        )
+        url = reverse("admin:core_recipe_changelist")
+        res = self.client.get(url)
+
+        self.assertContains(res, recipe.title)
+        self.assertContains(res, self.user.email)
@@ -7,26 +7,37 @@ from django.core.management import call_command
 from django.db.utils import OperationalError
 from django.test import SimpleTestCase
 
-@patch("core.management.commands.wait_for_db.Command.check")
+@patch("core.management.commands.wait_for_db.connections")
 class CommandTests(SimpleTestCase):
     """test commands"""
 
-    def test_wait_for_db_ready(self, patched_check):
+    def test_wait_for_db_ready(self, patched_connections):
         """test waiting for db if db is ready"""
-        patched_check.return_value = True
+        patched_ensure = patched_connections["default"].ensure_connection
+        patched_ensure.return_value = None
 
         call_command("wait_for_db")
 
-        patched_check.assert_called_once_with(databases = ["default"])
+        patched_ensure.assert_called_once_with()
 
     @patch("time.sleep")
-    def test_wait_for_db_delay(self, patched_sleep, patched_check):
+    def test_wait_for_db_delay(self, patched_sleep, patched_connections):
         """test waiting for db when getting operational error"""
-        patched_check.side_effect = [Psycopg2Error] * 2 + \
-            [OperationalError] * 3 + [True]
+        patched_ensure = patched_connections["default"].ensure_connection
+        patched_ensure.side_effect = [Psycopg2Error] * 2 + \
+            [OperationalError] * 3 + [None]
 
         call_command("wait_for_db")
 
-        self.assertEqual(patched_check.call_count, 6)
-        patched_check.assert_called_with(databases=["default"])
+        self.assertEqual(patched_ensure.call_count, 6)
 
+    @patch("time.sleep")
+    def test_wait_for_db_backoff(self, patched_sleep, patched_connections):
+        """test the delay between retries doubles and is capped"""
+        patched_ensure = patched_connections["default"].ensure_connection
+        patched_ensure.side_effect = [OperationalError] * 6 + [None]
+
+        call_command("wait_for_db")
+
+        delays = [c.args[0] for c in patched_sleep.call_args_list]
+        self.assertEqual(delays, [0.5, 1, 2, 4, 5, 5])
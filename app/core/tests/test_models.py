@@ -3,6 +3,7 @@
 from decimal import Decimal
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError
 from core import models
 from unittest.mock import patch
 
@@ -76,6 +77,14 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(tag), tag.name)
 
+    def test_tag_name_unique_per_user(self):
+        """test a user cannot have two tags with the same name"""
+        user = create_user()
+        models.Tag.objects.create(user=user, name="Tag1")
+
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name="Tag1")
+
     def test_create_ingredient(self):
         user = create_user()
         ingredient = models.Ingredient.objects.create(
@@ -1,9 +1,32 @@
 """serializer for recipe api"""
 
+from django.db import transaction
+from django.utils.translation import gettext as _
 from rest_framework import serializers
 from core.models import (Recipe, Tag, Ingredient)
 
-class IngredientSerializer(serializers.ModelSerializer):
+class RecipeAttrSerializer(serializers.ModelSerializer):
+    """base serializer for tags and ingredients"""
+
+    def validate_name(self, value):
+        """make sure the user has no other item with this name"""
+        #nested under a recipe, existing names are reused instead of renamed to
+        if self.root is not self:
+            return value
+
+        others = self.Meta.model.objects.filter(
+            user=self.context["request"].user,
+            name=value,
+        )
+        if self.instance is not None:
+            others = others.exclude(pk=self.instance.pk)
+
+        if others.exists():
+            raise serializers.ValidationError(_("You already have one with this name"))
+
+        return value
+
+class IngredientSerializer(RecipeAttrSerializer):
     """serializer for ingredient"""
 
     class Meta:
@@ -11,7 +34,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ["id", "name"]
         read_only_fields = ["id"]
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(RecipeAttrSerializer):
     """serializer for tag"""
 
     class Meta:
@@ -19,21 +42,11 @@ class TagSerializer(serializers.ModelSerializer):
         fields=["id", "name"]
         read_only_fields=["id"]
 
-#for my own implementation
-# class RecipeImageSerializer(serializers.ModelSerializer):
-
-#     class Meta:
-#         model = RecipeImage
-#         fields = ["id", "recipe", "image"]
-#         read_only_fields=["id"]
-#         extra_kwargs = {"image" : {"required": "True"}}
-
 
 class RecipeSerializer(serializers.ModelSerializer):
 
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required = False)
-    # images = RecipeImageSerializer(many=True, required = False)
 
     class Meta:
         model = Recipe
@@ -42,24 +55,83 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def _get_or_create_tags(self, tags, recipe):
         """handle getting or creating tags as needed"""
-        auth_user = self.context["request"].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user = auth_user,
-                **tag,  #instead of putting name = tag["name"], this code futureproofs users to add in other codes related to tags in future (eg: creation time, etc)
-            )
-            recipe.tags.add(tag_obj)
+        tag_objs = self._get_or_create_objs(Tag, tags)
+        #one multi row insert into the m2m table, already attached tags are skipped
+        Recipe.tags.through.objects.bulk_create(
+            [Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id) for tag in tag_objs],
+            ignore_conflicts=True,
+        )
 
     def _get_or_create_ingredients(self, ingredients, recipe):
         """handle gettin or creating ingredients as needed"""
-        auth_user = self.context["request"].user
-        for i in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **i,
-            )
-            recipe.ingredients.add(ingredient_obj)
+        ingredient_objs = self._get_or_create_objs(Ingredient, ingredients)
+        Recipe.ingredients.through.objects.bulk_create(
+            [
+                Recipe.ingredients.through(recipe_id=recipe.id, ingredient_id=i.id)
+                for i in ingredient_objs
+            ],
+            ignore_conflicts=True,
+        )
+
+    def _get_or_create_objs(self, model, items):
+        """insert the missing objects and fetch all of them by name"""
+        if not items:
+            return []
 
+        auth_user = self.context["request"].user
+        #dedupe repeated names in the payload before they reach the db,
+        #keeping the first occurrence of each name
+        items_by_name = {}
+        for item in items:
+            items_by_name.setdefault(item["name"], item)
+        #ON CONFLICT DO NOTHING against the unique (user, name) constraint,
+        #so names that already exist are skipped by the db instead of looked up first
+        model.objects.bulk_create(
+            #**item instead of name=item["name"] futureproofs extra fields on tags/ingredients (eg: creation time, etc)
+            [model(user=auth_user, **item) for item in items_by_name.values()],
+            ignore_conflicts=True,
+        )
+
+        return list(model.objects.filter(
+            user=auth_user,
+            name__in=list(items_by_name),
+        ).only("id", "name"))
+
+    def _update_tags(self, tags, recipe):
+        """replace the recipe tags, only writing the ones that changed"""
+        #uses the prefetched tags when the recipe comes from the viewset
+        current = {tag.name for tag in recipe.tags.all()}
+        desired = {tag["name"] for tag in tags}
+        if current == desired:
+            return
+
+        Recipe.tags.through.objects.filter(
+            recipe=recipe,
+            tag__name__in=current - desired,
+        ).delete()
+        self._get_or_create_tags(
+            [tag for tag in tags if tag["name"] not in current],
+            recipe,
+        )
+
+    def _update_ingredients(self, ingredients, recipe):
+        """replace the recipe ingredients, only writing the ones that changed"""
+        current = {i.name for i in recipe.ingredients.all()}
+        desired = {i["name"] for i in ingredients}
+        if current == desired:
+            return
+
+        Recipe.ingredients.through.objects.filter(
+            recipe=recipe,
+            ingredient__name__in=current - desired,
+        ).delete()
+        self._get_or_create_ingredients(
+            [i for i in ingredients if i["name"] not in current],
+            recipe,
+        )
+
+    #the recipe and its tags/ingredients are committed together, or not at all
+    @transaction.atomic
     def create(self, validated_data):
         """create a recipe"""
         #remove the tags in the validated__data if any, and assign it to tags, if not, put a [] inside
@@ -71,26 +143,79 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """update recipe"""
         tags = validated_data.pop("tags", None)
         ingredients = validated_data.pop("ingredients", None)
 
         if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
+            self._update_tags(tags, instance)
 
         if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+            self._update_ingredients(ingredients, instance)
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
-        instance.save()
+        if "image" in validated_data:
+            #the image has to go through save() so the file gets stored
+            instance.save()
+        elif validated_data:
+            #one UPDATE of just the sent columns instead of rewriting the whole row
+            Recipe.objects.filter(pk=instance.pk).update(**validated_data)
+
         return instance
 
 
+#read only list payload built from .values() rows, it renders the same data as
+#RecipeSerializer but skips instantiating models and DRF fields for every recipe
+RECIPE_LIST_FIELDS = ["id", "title", "time_minutes", "price", "link", "image"]
+
+def _related_values(through, related_name, recipe_ids):
+    """map recipe id to the id/name dicts of its related tags or ingredients"""
+    related = {recipe_id: [] for recipe_id in recipe_ids}
+    rows = through.objects.filter(recipe_id__in=recipe_ids).values_list(
+        "recipe_id", f"{related_name}_id", f"{related_name}__name",
+    )
+    for recipe_id, related_id, name in rows:
+        related[recipe_id].append({"id": related_id, "name": name})
+
+    return related
+
+def recipe_list_data(rows, request=None):
+    """return the recipe list payload for rows of RECIPE_LIST_FIELDS values"""
+    rows = list(rows)
+    if not rows:
+        return []
+
+    recipe_ids = [row["id"] for row in rows]
+    tags = _related_values(Recipe.tags.through, "tag", recipe_ids)
+    ingredients = _related_values(Recipe.ingredients.through, "ingredient", recipe_ids)
+    storage = Recipe._meta.get_field("image").storage
+
+    data = []
+    for row in rows:
+        image = row["image"]
+        if image:
+            image = storage.url(image)
+            if request is not None:
+                image = request.build_absolute_uri(image)
+
+        data.append({
+            "id": row["id"],
+            "title": row["title"],
+            "time_minutes": row["time_minutes"],
+            "price": str(row["price"]),
+            "link": row["link"],
+            "tags": tags[row["id"]],
+            "ingredients": ingredients[row["id"]],
+            "image": image or None,
+        })
+
+    return data
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     """serializer for recipe detail view"""
 
@@ -98,13 +223,14 @@ class RecipeDetailSerializer(RecipeSerializer):
         fields = RecipeSerializer.Meta.fields + ["description"]
 
 #we are creating a separate serializer just for image upload from recipe because we only
-#want to use a serialzier for a particular data type
-class RecipeImageSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Recipe
-        fields = ["id", "image"]
-        read_only_fields=["id"]
-        extra_kwargs = {"image" : {"required": "True"}}
-
+#want to use a serialzier for a particular data type, a plain serializer is enough for it
+class RecipeImageSerializer(serializers.Serializer):
+    """serializer for uploading images to recipes"""
+    id = serializers.IntegerField(read_only=True)
+    image = serializers.ImageField(required=True)
 
+    def update(self, instance, validated_data):
+        """store the image and only write the image column"""
+        instance.image = validated_data["image"]
+        instance.save(update_fields=["image"])
+        return instance
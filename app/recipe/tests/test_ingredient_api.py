@@ -1,11 +1,14 @@
 """tests for ingredient api"""
 
 from decimal import Decimal
+from functools import lru_cache
 
 
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -15,6 +18,7 @@ from recipe.serializers import IngredientSerializer
 
 INGREDIENT_URL = reverse("recipe:ingredient-list")
 
+@lru_cache(maxsize=None)
 def ingredient_url(ingredient_id):
     return reverse("recipe:ingredient-detail", args=[ingredient_id])
 
@@ -34,9 +38,12 @@ class PublicIngredientApiTest(TestCase):
 class PrivateIngredientApiTest(TestCase):
     """tests authenticated API req"""
 
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+
     def setUp(self):
         self.client = APIClient()
-        self.user = create_user()
         self.client.force_authenticate(self.user)
 
     def test_retrieve_ingredients(self):
@@ -48,7 +55,7 @@ class PrivateIngredientApiTest(TestCase):
         ingredients = Ingredient.objects.all().order_by("-name")
         serializer = IngredientSerializer(ingredients, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data["results"], serializer.data)
 
     def test_ingredients_limited_to_user(self):
         """only curr user can edit their own ingredients"""
@@ -59,9 +66,9 @@ class PrivateIngredientApiTest(TestCase):
         res = self.client.get(INGREDIENT_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]["name"], ingredient.name)
-        self.assertEqual(res.data[0]["id"], ingredient.id)
+        self.assertEqual(len(res.data["results"]), 1)
+        self.assertEqual(res.data["results"][0]["name"], ingredient.name)
+        self.assertEqual(res.data["results"][0]["id"], ingredient.id)
 
     def test_update_ingredients(self):
         ingredient = Ingredient.objects.create(user=self.user, name="curry leaves")
@@ -76,6 +83,18 @@ class PrivateIngredientApiTest(TestCase):
         ingredient.refresh_from_db()
         self.assertEqual(ingredient.name, payload["name"])
 
+    def test_update_ingredient_duplicate_name_error(self):
+        """test renaming to the name of another of the user's ingredients is rejected"""
+        Ingredient.objects.create(user=self.user, name="dessert")
+        ingredient = Ingredient.objects.create(user=self.user, name="dinner")
+
+        url = ingredient_url(ingredient.id)
+        res = self.client.patch(url, {"name": "dessert"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        ingredient.refresh_from_db()
+        self.assertEqual(ingredient.name, "dinner")
+
     def test_delete_ingredients(self):
         ingredient = Ingredient.objects.create(user=self.user, name="curry leaves")
         url = ingredient_url(ingredient.id)
@@ -103,8 +122,8 @@ class PrivateIngredientApiTest(TestCase):
         s1 = IngredientSerializer(in1)
         s2 = IngredientSerializer(in2)
 
-        self.assertIn(s1.data, res.data)
-        self.assertNotIn(s2.data, res.data)
+        self.assertIn(s1.data, res.data["results"])
+        self.assertNotIn(s2.data, res.data["results"])
 
     def test_filtered_ingredients_unique(self):
         """test filtered ingredients returna unique list"""
@@ -127,5 +146,25 @@ class PrivateIngredientApiTest(TestCase):
         r2.ingredients.add(ing)
 
         res = self.client.get(INGREDIENT_URL, {"assigned_only": 1})
-        self.assertEqual(len(res.data),1)
+        self.assertEqual(len(res.data["results"]),1)
+
+    def test_filter_assigned_ingredients_semijoin(self):
+        """test assigned_only filters with an EXISTS subquery, not a join and DISTINCT"""
+        ing = Ingredient.objects.create(user=self.user, name="eggs")
+        recipe = Recipe.objects.create(
+            title = "egg tarts",
+            time_minutes = 5,
+            price = Decimal("4.5"),
+            user = self.user,
+        )
+        recipe.ingredients.add(ing)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(INGREDIENT_URL, {"assigned_only": 1})
 
+        self.assertEqual(len(res.data["results"]), 1)
+        #the last query fetches the page, the first one counts
+        sql = queries[-1]["sql"]
+        self.assertIn("EXISTS", sql)
+        self.assertNotIn("DISTINCT", sql)
+        self.assertNotIn("JOIN", sql)
@@ -1,10 +1,14 @@
 """test for recipe api"""
 
 from decimal import Decimal
+from functools import lru_cache
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-import tempfile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
+import io
 import os
 
 from PIL import Image
@@ -24,31 +28,50 @@ from rest_framework import status
 
 RECIPES_URL = reverse("recipe:recipe-list")
 
+#reversing walks the urlconf, the urls only depend on the id so they are cached
+@lru_cache(maxsize=None)
 def image_upload_url(recipe_id):
     return reverse("recipe:recipe-upload-image", args=[recipe_id])
 
 #each detail url is going to be different and hence it is defined as a function
+@lru_cache(maxsize=None)
 def detail_url (recipe_id):
     """create and return a recipe detail url"""
     return reverse ("recipe:recipe-detail", args=[recipe_id])
 
+RECIPE_DEFAULTS = {
+    "title": "sample recipe title",
+    "time_minutes" : 22,
+    "price": Decimal("5.50"),
+    "description": "some description",
+    "link": "https://example.com/recipe.pdf",
+}
+
 def create_recipe(user, **params):
     """create and return sample recipe"""
-    defaults = {
-        "title": "sample recipe title",
-        "time_minutes" : 22,
-        "price": Decimal("5.50"),
-        "description": "some description",
-        "link": "https://example.com/recipe.pdf",
-    }
-    defaults.update(params)
+    defaults = {**RECIPE_DEFAULTS, **params}
 
     recipe = Recipe.objects.create(user=user, **defaults)
     return recipe
 
+def create_recipes(user, specs):
+    """create and return sample recipes in a single insert"""
+    return Recipe.objects.bulk_create(
+        [Recipe(user=user, **{**RECIPE_DEFAULTS, **spec}) for spec in specs]
+    )
+
 def create_user(**params):
     return get_user_model().objects.create_user(**params)
 
+def make_jpeg_bytes():
+    """create and return the bytes of a small jpeg image"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (10, 10)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+#encoded once and shared by every upload test
+JPEG_BYTES = make_jpeg_bytes()
+
 class PublicRecipeApiTests(TestCase):
     """test authenticated api requests"""
 
@@ -64,26 +87,35 @@ class PublicRecipeApiTests(TestCase):
 class PrivateRecipeApiTests(TestCase):
     """testing authenticated api requests"""
 
-    def setUp(self):
-        self.client = APIClient()
-        self.user = create_user(
+    @classmethod
+    def setUpTestData(cls):
+        #created once for the class, hashing the password for every test is slow
+        cls.user = create_user(
             email = "user@example.com",
             password = "test1234"
         )
+
+    def setUp(self):
+        self.client = APIClient()
         self.client.force_authenticate(self.user)
 
     def test_retrieve_recipe(self):
         """test retrieving a list of recipes"""
+        recipe = create_recipe(user=self.user)
         create_recipe(user=self.user)
-        create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name="vegan"))
+        recipe.ingredients.add(Ingredient.objects.create(user=self.user, name="tofu"))
 
-        res = self.client.get(RECIPES_URL)
+        #recipes, tags and ingredients, regardless of the number of recipes
+        with self.assertNumQueries(3):
+            res = self.client.get(RECIPES_URL)
 
-        recipes = Recipe.objects.all().order_by("-id")
+        recipes = Recipe.objects.all().prefetch_related("tags", "ingredients")
         #many=true here so that all the recipes will be returned, instead of 1
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        #the list has no guaranteed order, so compare the recipes regardless of it
+        self.assertCountEqual(res.data["results"], serializer.data)
 
     def test_recipe_list_limited_to_user(self):
         """test list of recipes is limited to authenticated user"""
@@ -95,19 +127,43 @@ class PrivateRecipeApiTests(TestCase):
         create_recipe(self.user)
         create_recipe(other_user)
 
-        res = self.client.get(RECIPES_URL)
+        with self.assertNumQueries(3):
+            res = self.client.get(RECIPES_URL)
 
-        recipes = Recipe.objects.filter(user=self.user)
+        recipes = Recipe.objects.filter(user=self.user).prefetch_related("tags", "ingredients")
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertCountEqual(res.data["results"], serializer.data)
+
+    def test_recipe_list_paginated(self):
+        """test the recipe list is paged newest first"""
+        recipes = create_recipes(self.user, [{"title": f"recipe {i}"} for i in range(51)])
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [r["id"] for r in res.data["results"]],
+            [r.id for r in reversed(recipes)][:50],
+        )
+        self.assertIsNotNone(res.data["next"])
+
+        res = self.client.get(res.data["next"])
+
+        self.assertEqual([r["id"] for r in res.data["results"]], [recipes[0].id])
+        self.assertIsNone(res.data["next"])
 
     def test_get_recipe_detail(self):
         """test get recipe detail"""
         recipe = create_recipe(self.user)
 
+        recipe.tags.add(Tag.objects.create(user=self.user, name="vegan"))
+        recipe.ingredients.add(Ingredient.objects.create(user=self.user, name="tofu"))
+
         url = detail_url(recipe.id)
-        res = self.client.get(url)
+        #recipe, then its prefetched tags and ingredients
+        with self.assertNumQueries(3):
+            res = self.client.get(url)
 
         serializer = RecipeDetailSerializer(recipe)
         self.assertEqual(res.data, serializer.data)
@@ -186,9 +242,15 @@ class PrivateRecipeApiTests(TestCase):
     def test_delete_recipe(self):
         recipe = create_recipe(user=self.user)
         url = detail_url(recipe.id)
-        res = self.client.delete(url)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.delete(url)
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(Recipe.objects.filter(id=recipe.id).exists())
+        #deleting never renders the tags/ingredients, so they are not prefetched
+        self.assertFalse(any(
+            q["sql"].startswith("SELECT") and "core_tag" in q["sql"]
+            for q in queries
+        ))
 
     def test_delete_other_users_recipe_error(self):
         """tests trying to delete another users recipe gives error"""
@@ -247,6 +309,24 @@ class PrivateRecipeApiTests(TestCase):
             ).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_with_duplicate_tags(self):
+        """test repeating a tag name in the payload only creates it once"""
+        payload = {
+            "title": "green curry",
+            "time_minutes": 30,
+            "price": Decimal("4.50"),
+            "tags": [{"name": "thai"}, {"name": "thai"}],
+            "ingredients": [{"name": "basil"}, {"name": "basil"}],
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data["id"])
+        self.assertEqual(recipe.tags.count(), 1)
+        self.assertEqual(recipe.ingredients.count(), 1)
+        self.assertEqual(Tag.objects.filter(user=self.user, name="thai").count(), 1)
+
     def test_create_tags_on_update(self):
         recipe = create_recipe(user=self.user)
         payload = {"tags": [{"name": "lunch"}]}
@@ -271,6 +351,23 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(tag_lunch, recipe.tags.all())
         self.assertNotIn(tag_breakfast, recipe.tags.all())
 
+    def test_update_recipe_same_tags_unchanged(self):
+        """test patching the current tags leaves the recipe tag rows alone"""
+        tag = Tag.objects.create(user=self.user, name="Breakfast")
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag)
+        recipe_tag = Recipe.tags.through.objects.get(recipe=recipe)
+
+        payload = {"tags": [{"name": "Breakfast"}]}
+        url = detail_url(recipe.id)
+        res = self.client.patch(url, payload, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(Recipe.tags.through.objects.filter(recipe=recipe)),
+            [recipe_tag],
+        )
+
     def test_clear_recipe_tags(self):
         tag = Tag.objects.create(user=self.user, name="dessert")
         recipe = create_recipe(user=self.user)
@@ -375,9 +472,11 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(recipe.ingredients.count(), 0)
 
     def test_filter_by_tags(self):
-        r1 = create_recipe(user=self.user, title="thai curry")
-        r2 = create_recipe(user=self.user, title="eggplant")
-        r3 = create_recipe(user=self.user, title="fish and chips")
+        r1, r2, r3 = create_recipes(self.user, [
+            {"title": "thai curry"},
+            {"title": "eggplant"},
+            {"title": "fish and chips"},
+        ])
 
         tag1 = Tag.objects.create(user=self.user, name="vegan")
         tag2 = Tag.objects.create(user=self.user, name="vegetarian")
@@ -385,21 +484,23 @@ class PrivateRecipeApiTests(TestCase):
         r1.tags.add(tag1)
         r2.tags.add(tag2)
 
-        params = {"tags": f'{tag1.id}, {tag2.id}'}
+        params = {"tags": [tag1.id, tag2.id]}
         res = self.client.get(RECIPES_URL, params)
 
         s1 = RecipeSerializer(r1)
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
 
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data["results"])
+        self.assertIn(s2.data, res.data["results"])
+        self.assertNotIn(s3.data, res.data["results"])
 
     def test_filter_by_ingredients(self):
-        r1 = create_recipe(user=self.user, title="nasi lemak")
-        r2 = create_recipe(user=self.user, title="mee rebus")
-        r3 = create_recipe(user=self.user, title="french fries")
+        r1, r2, r3 = create_recipes(self.user, [
+            {"title": "nasi lemak"},
+            {"title": "mee rebus"},
+            {"title": "french fries"},
+        ])
 
         in1 = Ingredient.objects.create(user=self.user, name="chicken")
         in2 = Ingredient.objects.create(user=self.user, name="sambal")
@@ -407,39 +508,94 @@ class PrivateRecipeApiTests(TestCase):
         r1.ingredients.add(in1)
         r2.ingredients.add(in2)
 
-        params = {"ingredients": f'{in1.id}, {in2.id}'}
+        params = {"ingredients": [in1.id, in2.id]}
         res = self.client.get(RECIPES_URL, params)
 
         s1 = RecipeSerializer(r1)
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
 
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data["results"])
+        self.assertIn(s2.data, res.data["results"])
+        self.assertNotIn(s3.data, res.data["results"])
+
+    def test_filter_by_tags_unique(self):
+        """test a recipe matching several of the filtered tags is listed once"""
+        recipe = create_recipe(user=self.user)
+        tag1 = Tag.objects.create(user=self.user, name="vegan")
+        tag2 = Tag.objects.create(user=self.user, name="vegetarian")
+        recipe.tags.add(tag1, tag2)
+
+        res = self.client.get(RECIPES_URL, {"tags": [tag1.id, tag2.id]})
+
+        self.assertEqual(len(res.data["results"]), 1)
+
+    def test_list_recipes_without_distinct(self):
+        """test listing recipes, filtered or not, does not need SELECT DISTINCT"""
+        recipe = create_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name="vegan")
+        recipe.tags.add(tag)
+
+        for params in [{}, {"tags": [tag.id]}]:
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn("DISTINCT", queries[0]["sql"])
+
+    def test_filter_by_comma_separated_tags(self):
+        """test the comma separated form of the tags filter is still accepted"""
+        r1, r2 = create_recipes(self.user, [
+            {"title": "thai curry"},
+            {"title": "fish and chips"},
+        ])
+        tag = Tag.objects.create(user=self.user, name="vegan")
+        other_tag = Tag.objects.create(user=self.user, name="spicy")
+        r1.tags.add(tag)
+
+        res = self.client.get(RECIPES_URL, {"tags": f"{tag.id},{other_tag.id}"})
+
+        self.assertEqual([r["id"] for r in res.data["results"]], [r1.id])
+
+    def test_filter_by_empty_ids_unfiltered(self):
+        """test empty tags/ingredients params list every recipe"""
+        create_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL, {"tags": "", "ingredients": ""})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data["results"]), 1)
+
+    def test_filter_by_invalid_ids_error(self):
+        """test filtering with ids that are not integers returns a bad request"""
+        res = self.client.get(RECIPES_URL, {"tags": "1,vegan"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class ImageUploadTests(TestCase):
 
-    def setUp(self):
-        self.client = APIClient()
-        self.user = get_user_model().objects.create_user(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
             "user@example.com",
             "pass12345"
         )
+        cls.recipe = create_recipe(user=cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
         self.client.force_authenticate(self.user)
-        self.recipe = create_recipe(user=self.user)
 
     def tearDown(self):
         self.recipe.image.delete()
 
     def test_upload_image(self):
         url = image_upload_url(self.recipe.id)
-        with tempfile.NamedTemporaryFile(suffix=".jpg") as image_file:
-            img = Image.new("RGB", (10, 10))
-            img.save(image_file, format="JPEG")
-            image_file.seek(0)
-            payload = {"image": image_file}
+        image_file = SimpleUploadedFile("image.jpg", JPEG_BYTES, "image/jpeg")
+        payload = {"image": image_file}
+        #fetch the recipe, without its tags/ingredients, then update the image column
+        with self.assertNumQueries(2):
             res = self.client.post(url, payload, format="multipart")
 
         self.recipe.refresh_from_db()
@@ -447,10 +603,24 @@ class ImageUploadTests(TestCase):
         self.assertIn("image", res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_list_image_url_matches_detail(self):
+        """test the list endpoint renders the same image url as the detail endpoint"""
+        url = image_upload_url(self.recipe.id)
+        image_file = SimpleUploadedFile("image.jpg", JPEG_BYTES, "image/jpeg")
+        self.client.post(url, {"image": image_file}, format="multipart")
+        self.recipe.refresh_from_db()
+
+        list_res = self.client.get(RECIPES_URL)
+        detail_res = self.client.get(detail_url(self.recipe.id))
+
+        self.assertIsNotNone(detail_res.data["image"])
+        self.assertEqual(list_res.data["results"][0]["image"], detail_res.data["image"])
+
     def test_upload_image_bad_request(self):
         url = image_upload_url(self.recipe.id)
         payload = {"image": "notanimage"}
-        res = self.client.post(url, payload, format="multipart")
+        with self.assertNumQueries(0):
+            res = self.client.post(url, payload, format="multipart")
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
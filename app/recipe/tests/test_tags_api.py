@@ -1,18 +1,23 @@
 """tests for tags api"""
 from decimal import Decimal
+from functools import lru_cache
 
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
 
 from core.models import (Tag, Recipe)
 from recipe.serializers import TagSerializer
 
 TAGS_URL = reverse('recipe:tag-list')
 
+@lru_cache(maxsize=None)
 def detail_url(tag_id):
     return reverse("recipe:tag-detail", args=[tag_id])
 
@@ -32,8 +37,11 @@ class PublicTagApiTests(TestCase):
 
 class PrivateTagsAPITests(TestCase):
 
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+
     def setUp(self):
-        self.user = create_user()
         self.client = APIClient()
         self.client.force_authenticate(self.user)
 
@@ -44,10 +52,12 @@ class PrivateTagsAPITests(TestCase):
 
         res = self.client.get(TAGS_URL)
 
-        tags = Tag.objects.all().order_by("-name")
-        serializer = TagSerializer(tags, many=True)
+        tags = Tag.objects.filter(user=self.user).order_by("-name")
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(
+            [(row["id"], row["name"]) for row in res.data["results"]],
+            list(tags.values_list("id", "name")),
+        )
 
     def test_tags_limited_to_user(self):
         """test list of tags limited to authenticated user"""
@@ -59,9 +69,33 @@ class PrivateTagsAPITests(TestCase):
         res = self.client.get(TAGS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]["name"], tag.name)
-        self.assertEqual(res.data[0]["id"], tag.id)
+        self.assertEqual(len(res.data["results"]), 1)
+        self.assertEqual(res.data["results"][0]["name"], tag.name)
+        self.assertEqual(res.data["results"][0]["id"], tag.id)
+
+    def test_list_tags_without_distinct(self):
+        """test listing all tags does not need SELECT DISTINCT"""
+        Tag.objects.create(user=self.user, name="Vegan")
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        for query in queries:
+            self.assertNotIn("DISTINCT", query["sql"])
+
+    def test_token_auth_user_looked_up_once(self):
+        """test a token authenticated list resolves the user in a single query"""
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        Tag.objects.create(user=self.user, name="Vegan")
+
+        #token joined with its user, then the page count and the page itself
+        with self.assertNumQueries(3):
+            res = client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
 
     def test_update_tag(self):
         tag = Tag.objects.create(user=self.user, name="dessert")
@@ -77,6 +111,18 @@ class PrivateTagsAPITests(TestCase):
 
         self.assertEqual(tag.name, payload["name"])
 
+    def test_update_tag_duplicate_name_error(self):
+        """test renaming to the name of another of the user's tags is rejected"""
+        Tag.objects.create(user=self.user, name="dessert")
+        tag = Tag.objects.create(user=self.user, name="dinner")
+
+        url = detail_url(tag.id)
+        res = self.client.patch(url, {"name": "dessert"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, "dinner")
+
     def test_delete_tag(self):
         tag = Tag.objects.create(user=self.user, name="dessert")
         url = detail_url(tag.id)
@@ -86,8 +132,10 @@ class PrivateTagsAPITests(TestCase):
 
     def test_filter_tags_assigned_to_recipes(self):
         """test listing tags by those assigned to recipes"""
-        t1= Tag.objects.create(user=self.user, name="breakfast")
-        t2= Tag.objects.create(user=self.user, name="dinner")
+        t1, t2 = Tag.objects.bulk_create([
+            Tag(user=self.user, name="breakfast"),
+            Tag(user=self.user, name="dinner"),
+        ])
 
         recipe = Recipe.objects.create(
             title = "apple crumble",
@@ -99,36 +147,45 @@ class PrivateTagsAPITests(TestCase):
         recipe.tags.add(t1)
         res = self.client.get(TAGS_URL, {"assigned_only" : 1})
 
-        s1 = TagSerializer(t1)
-        s2 = TagSerializer(t2)
+        s1_data, s2_data = TagSerializer([t1, t2], many=True).data
 
-        self.assertIn(s1.data, res.data)
-        self.assertNotIn(s2.data, res.data)
+        self.assertIn(s1_data, res.data["results"])
+        self.assertNotIn(s2_data, res.data["results"])
 
     def test_filtered_tags_unique(self):
         """test filtered tags returna unique list"""
-        tag = Tag.objects.create(user=self.user, name="breakfast")
-        Tag.objects.create(user=self.user, name="dinner")
-        r1 = Recipe.objects.create(
-            title = "egg tarts",
-            time_minutes = 5,
-            price = Decimal("4.5"),
-            user = self.user,
-        )
-        r2 = Recipe.objects.create(
-            title = "apple pie",
-            time_minutes = 56,
-            price = Decimal("4.5"),
-            user = self.user,
-        )
-
-        r1.tags.add(tag)
-        r2.tags.add(tag)
+        tag, _ = Tag.objects.bulk_create([
+            Tag(user=self.user, name="breakfast"),
+            Tag(user=self.user, name="dinner"),
+        ])
+        r1, r2 = Recipe.objects.bulk_create([
+            Recipe(
+                title = "egg tarts",
+                time_minutes = 5,
+                price = Decimal("4.5"),
+                user = self.user,
+            ),
+            Recipe(
+                title = "apple pie",
+                time_minutes = 56,
+                price = Decimal("4.5"),
+                user = self.user,
+            ),
+        ])
+
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=r1, tag=tag),
+            Recipe.tags.through(recipe=r2, tag=tag),
+        ])
 
         res = self.client.get(TAGS_URL, {"assigned_only": 1})
-        self.assertEqual(len(res.data),1)
-
-
+        self.assertEqual(len(res.data["results"]),1)
 
+    def test_filter_tags_invalid_assigned_only(self):
+        """test a non numeric assigned_only lists all tags instead of erroring"""
+        Tag.objects.create(user=self.user, name="breakfast")
 
+        res = self.client.get(TAGS_URL, {"assigned_only": "yes please"})
 
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data["results"]), 1)
@@ -5,6 +5,8 @@ from drf_spectacular.utils import (
     OpenApiTypes,
 )
 from django.shortcuts import render
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils.functional import cached_property
 from rest_framework import (
     viewsets,
     mixins,
@@ -13,24 +15,37 @@ from rest_framework import (
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
 from core.models import (Recipe, Tag, Ingredient)
 from recipe import serializers
 
 
+class RecipePagination(CursorPagination):
+    """newest recipes first, the cursor seeks on the pk index instead of using OFFSET"""
+    ordering = "-id"
+    page_size = 50
+
+
+class RecipeAttrPagination(PageNumberPagination):
+    """pages of tags/ingredients"""
+    page_size = 50
+
+
 @extend_schema_view(
     list=extend_schema(
         parameters=[
             OpenApiParameter(
                 "tags",
                 OpenApiTypes.STR,
-                description="Comma separated list of IDs to filter",
+                description="Repeated or comma separated list of IDs to filter",
             ),
             OpenApiParameter(
                 "ingredients",
                 OpenApiTypes.STR,
-                description="Comma separated list of IDs to filter",
+                description="Repeated or comma separated list of IDs to filter",
             )
         ]
     )
@@ -43,26 +58,48 @@ class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipePagination
 
-    def _params_to_ints(self, qs):
-        """convert a list of str to int"""
-        return [int(str_id) for str_id in qs.split(",")]
+    def _params_to_ints(self, values):
+        """convert repeated and/or comma separated str ids to ints"""
+        #empty values like ?tags= are ignored rather than treated as bad ids
+        str_ids = [s for value in values for s in value.split(",") if s.strip()]
+        try:
+            return list(map(int, str_ids))
+        except ValueError:
+            raise ValidationError("IDs to filter must be integers")
 
     def get_queryset(self):
         """retrieve recipes for authenticated user"""
-        tags = self.request.query_params.get("tags")
-        ingredients = self.request.query_params.get("ingredients")
+        query_params = self.request.query_params
+        #accepts ?tags=1&tags=2 as well as ?tags=1,2
+        tag_ids = self._params_to_ints(query_params.getlist("tags"))
+        ingredient_ids = self._params_to_ints(query_params.getlist("ingredients"))
         queryset = self.queryset
 
-        if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+        #only these actions render or diff the nested tag/ingredient serializers,
+        #which only need the id and name columns
+        if self.action in ("retrieve", "update", "partial_update"):
+            queryset = queryset.prefetch_related(
+                Prefetch("tags", queryset=Tag.objects.only("id", "name")),
+                Prefetch("ingredients", queryset=Ingredient.objects.only("id", "name")),
+            )
+
+        #EXISTS subqueries on the m2m tables rather than joins, so a recipe matching
+        #several of the ids is not duplicated and no DISTINCT is needed
+        if tag_ids:
+            queryset = queryset.filter(Exists(Recipe.tags.through.objects.filter(
+                recipe_id=OuterRef("pk"),
+                tag_id__in=tag_ids,
+            )))
 
-        if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+        if ingredient_ids:
+            queryset = queryset.filter(Exists(Recipe.ingredients.through.objects.filter(
+                recipe_id=OuterRef("pk"),
+                ingredient_id__in=ingredient_ids,
+            )))
 
-        return queryset.filter(user=self.request.user).order_by("-id").distinct()
+        return queryset.filter(user=self.request.user)
 
     def get_serializer_class(self):
         """return the serializer class for request"""
@@ -74,6 +111,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return self.serializer_class
 
+    def list(self, request, *args, **kwargs):
+        """list recipes from plain values instead of going through RecipeSerializer"""
+        rows = self.filter_queryset(self.get_queryset()).values(
+            *serializers.RECIPE_LIST_FIELDS
+        )
+        #the paginator slices the rows first, so only the page's tags/ingredients get fetched
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializers.recipe_list_data(page, request))
+
+        return Response(serializers.recipe_list_data(rows, request))
+
     def perform_create(self, serializer):
         """create a new recipe"""
         serializer.save(user=self.request.user)
@@ -83,14 +132,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(methods=["POST"], detail=True, url_path="upload-image")
     def upload_image(self, request, pk=None):
         """upload an image to a recipe"""
-        recipe = self.get_object()
-        serializer = self.get_serializer(recipe, data=request.data)
+        #validate the upload first so a bad request never looks up the recipe
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer.instance = self.get_object()
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 #our API only need list capabilities, because tags and ingredients are added through the recipe endpoint and the tags/ingredients endpoints is only for retrieving a list for the user to select from..
@@ -119,31 +167,48 @@ class BaseRecipeArrtViewSet(mixins.ListModelMixin,
     """base viewset for recipe attributes"""
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeAttrPagination
+
+    #name of the Recipe m2m field pointing at the model, set by the subclasses
+    recipe_relation = None
+
+    def _assigned_to_recipes(self):
+        """return an EXISTS subquery matching items linked to at least one recipe"""
+        field = Recipe._meta.get_field(self.recipe_relation)
+        return Exists(field.remote_field.through.objects.filter(
+            **{field.m2m_reverse_field_name(): OuterRef("pk")}
+        ))
+
+    @cached_property
+    def assigned_only(self):
+        """parse the assigned_only param once, anything but 1/true means all items"""
+        return self.request.query_params.get("assigned_only") in ("1", "true", "True")
 
     def get_queryset(self):
 
-        assigned_only = bool(
-            int(self.request.query_params.get("assigned_only", 0))
-        )
         queryset = self.queryset
 
-        if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+        if self.assigned_only:
+            #semijoin, an item used by many recipes still comes back once without DISTINCT
+            queryset = queryset.filter(self._assigned_to_recipes())
 
-        return queryset.filter(user=self.request.user).order_by("-name").distinct()
+        return queryset.filter(user=self.request.user).order_by("-name")
 
 
 class TagViewSet(BaseRecipeArrtViewSet):
     """manage tags in db"""
     serializer_class = serializers.TagSerializer
-    queryset = Tag.objects.all()
+    #the serializer only renders id and name, user is only needed for the filter
+    queryset = Tag.objects.only("id", "name", "user")
+    recipe_relation = "tags"
 
 
 class IngredientViewSet(BaseRecipeArrtViewSet):
     """manage ingredients in db"""
 
     serializer_class = serializers.IngredientSerializer
-    queryset = Ingredient.objects.all()
+    queryset = Ingredient.objects.only("id", "name", "user")
+    recipe_relation = "ingredients"
 
 
 
@@ -131,6 +131,13 @@ class PrivateUserApiTests(TestCase):
             }
         )
 
+    def test_retrieve_profile_no_queries(self):
+        """test the profile is served from the authenticated user without db queries"""
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
     def test_post_me_not_allowed(self):
         """test POST is not allowed for the me endpoint"""
         res = self.client.post(ME_URL, {})